@@ -0,0 +1,73 @@
+"""Benchmark /broadcast fan-out against a fake Bot (no network, no database).
+
+    python bench_broadcast.py
+
+Sends to USERS fake recipients with SEND_LATENCY per call. Every 97th user
+raises Forbidden, and one send hits flood control, so pruning and the
+shared pause are exercised too.
+"""
+import asyncio
+import time
+
+from telegram.error import Forbidden, RetryAfter
+
+import order_bot
+
+USERS = 3000
+SEND_LATENCY = 0.02   # seconds per fake Telegram call
+FLOOD_AT = 500        # user id whose first send raises RetryAfter
+
+
+class FakeBot:
+    def __init__(self):
+        self.calls = 0
+        self.flooded = False
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(SEND_LATENCY)
+        if chat_id % 97 == 0:
+            raise Forbidden("bot was blocked by the user")
+        if chat_id == FLOOD_AT and not self.flooded:
+            self.flooded = True
+            raise RetryAfter(1)
+
+    send_photo = send_message
+
+    async def edit_message_text(self, **kwargs):
+        pass
+
+
+def new_job(recipients):
+    return {
+        "id": None, "text": "📣 New menu is live!", "photo": None, "recipients": recipients,
+        "next_index": 0, "sent": 0, "failed": 0, "blocked": 0, "status": "running",
+        "chat_id": None, "message_id": None,
+    }
+
+
+async def run(label, recipients, rate):
+    bot = FakeBot()
+    job = new_job(recipients)
+    started = time.perf_counter()
+    await order_bot.run_broadcast(bot, job, limiter=order_bot.RateLimiter(rate))
+    elapsed = time.perf_counter() - started
+    print(
+        f"{label:<28} {len(recipients):>5} users  {elapsed:6.2f} s  "
+        f"{len(recipients) / elapsed:7.1f} msg/s  "
+        f"sent={job['sent']} blocked={job['blocked']} failed={job['failed']}"
+    )
+
+
+async def main():
+    recipients = list(range(1, USERS + 1))
+    order_bot.KNOWN_USERS.update(recipients)
+    # rate effectively unlimited: measures the worker pool itself
+    await run("pool only (rate 10000/s)", recipients, 10000)
+    # production rate: throughput should sit just under BROADCAST_RATE
+    await run(f"limited ({order_bot.BROADCAST_RATE}/s)", recipients[:250], order_bot.BROADCAST_RATE)
+    print(f"known users after pruning: {len(order_bot.KNOWN_USERS)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,79 @@
+"""Benchmark rendering of the admin order list (send_orders_list blocks).
+
+    python bench_render.py
+
+Renders ORDERS synthetic orders with Markdown-special characters in the
+user fields three ways: the old unescaped f-string with a fresh strftime per
+order, the template with cold caches, and the template with warm caches.
+"""
+import random
+import time
+from datetime import datetime
+
+import order_bot
+
+ORDERS = 10_000
+ROUNDS = 5
+
+
+def make_orders(n):
+    now = time.time()
+    orders = []
+    for i in range(n):
+        item, qty = random.choice(order_bot.VARIANT_KEYS)
+        price = order_bot.PRODUCT_PRICES[item][qty]
+        orders.append({
+            "id": order_bot.generate_order_id(),
+            "user_id": 1000 + i,
+            "name": f"john_doe*{i}",
+            "items": f"• {qty} {item} - ${price}",
+            "total": price,
+            "address": {"return_number": f"bc1q_[{i}]"},
+            "ts": now - i * 37,
+        })
+    return orders
+
+
+def old_block(o):
+    addr = o.get("address", {})
+    dt = datetime.fromtimestamp(o["ts"], order_bot.TZ_EST)
+    return (
+        "────────────\n"
+        f"#{o['id']}  |  🕒 {dt.strftime('%b %d, %Y – %I:%M %p %Z')}\n"
+        f"🔁 Return #: {addr.get('return_number','—')}\n"
+        f"👤 {o.get('name','')}  |  🆔 {o.get('user_id','')}\n"
+        f"{o['items']}\n"
+        f"💰 Total: ${o['total']}"
+    )
+
+
+def best_of(fn, setup=None):
+    times = []
+    for _ in range(ROUNDS):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def clear_caches():
+    order_bot.ORDER_BLOCK_CACHE.clear()
+    order_bot._fmt_minute.cache_clear()
+
+
+def main():
+    random.seed(0)
+    orders = make_orders(ORDERS)
+    results = [
+        ("f-string + strftime (old)", best_of(lambda: [old_block(o) for o in orders])),
+        ("template, cold caches", best_of(lambda: [order_bot.render_order_block(o) for o in orders], clear_caches)),
+        ("template, warm caches", best_of(lambda: [order_bot.render_order_block(o) for o in orders])),
+    ]
+    for label, seconds in results:
+        print(f"{label:<28} {ORDERS} orders  {seconds * 1000:8.1f} ms  {ORDERS / seconds:10,.0f} orders/s")
+
+
+if __name__ == "__main__":
+    main()
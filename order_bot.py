@@ -1,10 +1,20 @@
 import os
 import random
+import re
 import string
 import time
 import logging
 import os
 import asyncio
+import csv
+import gzip
+import io
+import json
+import tempfile
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, OrderedDict
+from functools import lru_cache
 import asyncpg
 
 # === DATABASE CONFIG ===
@@ -25,6 +35,21 @@ async def setup_tables(pool):
                 cart JSONB DEFAULT '{}'::jsonb
             );
         """)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id SERIAL PRIMARY KEY,
+                text TEXT,
+                photo TEXT,
+                recipients BIGINT[] NOT NULL,
+                next_index INT DEFAULT 0,
+                sent INT DEFAULT 0,
+                failed INT DEFAULT 0,
+                blocked INT DEFAULT 0,
+                chat_id BIGINT,
+                message_id BIGINT,
+                status TEXT DEFAULT 'running'
+            );
+        """)
         print("✅ Tables are ready")
 
 async def save_user(pool, user_id, username, balance=0, cart=None):
@@ -43,7 +68,28 @@ async def load_user(pool, user_id):
         row = await conn.fetchrow("SELECT * FROM users WHERE user_id=$1", user_id)
         return dict(row) if row else None
 
-from datetime import datetime, date
+async def create_broadcast(pool, text, photo, recipients, chat_id, message_id):
+    async with pool.acquire() as conn:
+        return await conn.fetchval("""
+            INSERT INTO broadcasts (text, photo, recipients, chat_id, message_id)
+            VALUES ($1, $2, $3, $4, $5)
+            RETURNING id
+        """, text, photo, recipients, chat_id, message_id)
+
+async def checkpoint_broadcast(pool, job):
+    async with pool.acquire() as conn:
+        await conn.execute("""
+            UPDATE broadcasts
+            SET next_index=$2, sent=$3, failed=$4, blocked=$5, status=$6
+            WHERE id=$1
+        """, job["id"], job["next_index"], job["sent"], job["failed"], job["blocked"], job["status"])
+
+async def load_running_broadcasts(pool):
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("SELECT * FROM broadcasts WHERE status='running' ORDER BY id")
+        return [dict(row) for row in rows]
+
+from datetime import datetime, date, timedelta
 try:
     from zoneinfo import ZoneInfo  # Python 3.9+
     TZ_EST = ZoneInfo("America/New_York")
@@ -55,13 +101,17 @@ from telegram import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
     InputMediaPhoto,
+    InputFile,
 )
+from telegram.error import Forbidden, NetworkError, RetryAfter, TelegramError
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
     CallbackQueryHandler,
     MessageHandler,
     ContextTypes,
+    TypeHandler,
+    ApplicationHandlerStop,
     filters,
 )
 
@@ -114,17 +164,149 @@ USER_STATS = {}
 KNOWN_USERS = set()
 PENDING_PAYMENTS = {}      # user_id -> order_id (awaiting payment)
 LAST_ORDER_BY_USER = {}    # user_id -> last order dict (pending or completed)
+PHOTO_FILE_IDS = {}        # image URL -> Telegram file_id once uploaded
 
 
 def fmt_ts(ts: float) -> str:
     """Format timestamp in EST if available, else server local time."""
+    # output has minute resolution, so every timestamp in the same minute shares one result
+    return _fmt_minute(int(ts // 60))
+
+
+@lru_cache(maxsize=4096)
+def _fmt_minute(minute: int) -> str:
     if TZ_EST:
-        dt = datetime.fromtimestamp(ts, TZ_EST)
+        dt = datetime.fromtimestamp(minute * 60, TZ_EST)
         return dt.strftime("%b %d, %Y – %I:%M %p %Z")
-    dt = datetime.fromtimestamp(ts)
+    dt = datetime.fromtimestamp(minute * 60)
     return dt.strftime("%b %d, %Y – %I:%M %p")
 
 
+# ===== TEMPLATES =====
+def md_escape(value) -> str:
+    """Escape text for parse_mode="Markdown" so user input can't open an entity."""
+    # chained replace beats str.translate here: translate falls back to a slow path on emoji
+    return str(value).replace("_", "\\_").replace("*", "\\*").replace("`", "\\`").replace("[", "\\[")
+
+
+class MessageTemplate:
+    """Markdown message template, parsed once at import.
+
+    Every field is escaped on render except those named in `raw`, which are
+    for text the bot built itself (item lines, code spans).
+    """
+
+    def __init__(self, text: str, raw=()):
+        self._parts = [
+            (literal, field, spec or "", field in raw)
+            for literal, field, spec, _ in string.Formatter().parse(text)
+        ]
+
+    def render(self, **fields) -> str:
+        out = []
+        for literal, field, spec, raw in self._parts:
+            out.append(literal)
+            if field is not None:
+                value = format(fields[field], spec) if spec else str(fields[field])
+                out.append(value if raw else md_escape(value))
+        return "".join(out)
+
+
+CART_TEMPLATE = MessageTemplate(
+    "🛒 *Your Cart:*\n\n{items}\n\n💰 *Total:* ${total}",
+    raw=("items",),
+)
+ORDER_SUMMARY_TEMPLATE = MessageTemplate(
+    "✅ *Order #{order_id} Complete!*\n\n"
+    "{items}\n\n"
+    "💰 *Total:* ${total}\n"
+    "🔁 *Return #:* {return_number}\n\n"
+    "📍 *Shipping Address:*\n"
+    "{first_name} {last_name}\n"
+    "{full}\n"
+    "{town}, {state} {zip}",
+    raw=("items",),
+)
+ADMIN_ORDER_ALERT_TEMPLATE = MessageTemplate(
+    "📦 *New Order #{order_id}*\n"
+    "🔁 Return #: {return_number}\n"
+    "👤 Buyer: {buyer} ({username})\n"
+    "🆔 ID: {user_id}\n\n"
+    "{items}\n💰 *Total:* ${total}\n\n"
+    "📍 *Shipping Address:*\n"
+    "{first_name} {last_name}\n"
+    "{full}\n"
+    "{town}, {state} {zip}\n"
+    "🕒 {ts}\n"
+    "⌛ Awaiting payment.",
+    raw=("items", "ts"),
+)
+SHIPPING_NOTICE_TEMPLATE = MessageTemplate(
+    "🚚 *Order complete!* Your tracking number is `{tracking}`.\nThank you for your order!",
+    raw=("tracking",),
+)
+ADMIN_SHIPPED_TEMPLATE = MessageTemplate(
+    "✅ *Order Shipped*\n"
+    "#{order_id} | 🕒 {ts}\n"
+    "👤 Buyer: {buyer} (ID: {user_id})\n"
+    "🔁 Return #: {return_number}\n"
+    "{items}\n"
+    "💰 Total: ${total}\n"
+    "🚚 Tracking: `{tracking}`",
+    raw=("items", "ts", "tracking"),
+)
+HELP_ALERT_TEMPLATE = MessageTemplate(
+    "🚨 *Help Request*\n"
+    "👤 From: @{username} ({user_id})\n"
+    "🧾 Order ID: {order_id}\n"
+    "🔁 Return #: {return_number}\n"
+    "💬 Message: {message}"
+)
+ORDER_BLOCK_TEMPLATE = MessageTemplate(
+    "────────────\n"
+    "#{order_id}  |  🕒 {ts}\n"
+    "🔁 Return #: {return_number}\n"
+    "👤 {name}  |  🆔 {user_id}\n"
+    "{items}\n"
+    "💰 Total: ${total}",
+    raw=("items", "ts"),
+)
+
+ORDER_BLOCK_CACHE = OrderedDict()   # (id, ts, version) -> rendered block, least recently used first
+ORDER_BLOCK_CACHE_SIZE = 20000
+
+
+def format_item_lines(lines) -> str:
+    return "\n".join(f"• {i['qty']} {i['item']} - ${i['price']}" for i in lines)
+
+
+def code_span(value) -> str:
+    """Text for inside `...`; Markdown has no escaping there, so drop backticks."""
+    return str(value).replace("`", "'")
+
+
+def render_order_block(o: dict) -> str:
+    """Rendered order for admin lists, cached per order; bump o["version"] after editing one in place."""
+    key = (o.get("id"), o.get("ts"), o.get("version", 0))
+    block = ORDER_BLOCK_CACHE.get(key)
+    if block is not None:
+        ORDER_BLOCK_CACHE.move_to_end(key)
+    else:
+        block = ORDER_BLOCK_TEMPLATE.render(
+            order_id=o["id"],
+            ts=fmt_ts(o["ts"]),
+            return_number=o.get("address", {}).get("return_number", "—"),
+            name=o.get("name", ""),
+            user_id=o.get("user_id", ""),
+            items=o["items"],
+            total=o["total"],
+        )
+        ORDER_BLOCK_CACHE[key] = block
+        if len(ORDER_BLOCK_CACHE) > ORDER_BLOCK_CACHE_SIZE:
+            ORDER_BLOCK_CACHE.popitem(last=False)
+    return block
+
+
 def build_main_menu(order_count=0):
     keyboard = [[InlineKeyboardButton(cat, callback_data=f"cat:{cat}")] for cat in MENU_STRUCTURE]
     keyboard.append([
@@ -226,7 +408,10 @@ def est_today_date() -> date:
 # ===== helper: try photo; else send URL with preview =====
 async def _send_photo_or_link(message, url: str, caption: str, mode: str = "Markdown", markup=None):
     try:
-        return await message.reply_photo(photo=url, caption=caption, parse_mode=mode, reply_markup=markup)
+        sent = await message.reply_photo(photo=PHOTO_FILE_IDS.get(url, url), caption=caption, parse_mode=mode, reply_markup=markup)
+        if sent.photo:
+            PHOTO_FILE_IDS[url] = sent.photo[-1].file_id
+        return sent
     except Exception as e:
         log.warning(f"reply_photo failed for {url}: {e}")
         # Fallback so the user still sees the image via link preview
@@ -286,6 +471,136 @@ async def admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+# ===== ANTI-FLOOD =====
+# callback prefix -> (max events, window seconds); "" is the fallback for anything else
+FLOOD_LIMITS = {
+    "add:": (10, 10),
+    "cat:": (8, 10),
+    "item:": (8, 10),
+    "": (15, 10),
+}
+TEXT_FLOOD_LIMIT = (6, 10)       # address-flow messages per window
+DUPLICATE_CLICK_WINDOW = 1.0     # same button on the same message within this many seconds is dropped
+FLOOD_IDLE_TTL = 10 * 60         # forget users idle this long
+
+
+class FloodGuard:
+    """Per-user sliding-window limiter.
+
+    Each (user, bucket) keeps only the current and previous window counts, and
+    the previous count is weighted by how much of it still overlaps the sliding
+    window — O(1) memory per active user. Entries live in OrderedDicts ordered
+    by last activity, so idle users are evicted from the front.
+    """
+
+    def __init__(self, idle_ttl: float = FLOOD_IDLE_TTL):
+        self.idle_ttl = idle_ttl
+        self._windows = OrderedDict()     # (user_id, bucket) -> [window_start, prev, curr, last_seen]
+        self._last_click = OrderedDict()  # user_id -> (message_id, data, ts)
+        self._throttled = OrderedDict()   # user_id -> [dropped updates, last_dropped]
+
+    def allow(self, key, limit: int, window: float, now: float) -> bool:
+        self._evict(now)
+        st = self._windows.pop(key, None) or [now, 0, 0, now]
+        self._windows[key] = st
+        start, prev, curr = st[0], st[1], st[2]
+        if now - start >= 2 * window:
+            start, prev, curr = now, 0, 0
+        elif now - start >= window:
+            start, prev, curr = start + window, curr, 0
+        estimated = prev * (1 - (now - start) / window) + curr
+        allowed = estimated < limit
+        st[:] = [start, prev, curr + 1 if allowed else curr, now]
+        return allowed
+
+    def is_duplicate(self, user_id: int, message_id, data: str, now: float) -> bool:
+        last = self._last_click.pop(user_id, None)
+        self._last_click[user_id] = (message_id, data, now)
+        return bool(last) and last[:2] == (message_id, data) and now - last[2] < DUPLICATE_CLICK_WINDOW
+
+    def record_throttle(self, user_id: int, now: float, window: float) -> bool:
+        """Count a dropped update; True if it starts a new episode (no drop in the last window)."""
+        st = self._throttled.pop(user_id, None)
+        first = st is None or now - st[1] >= window
+        st = [(st[0] if st else 0) + 1, now]
+        self._throttled[user_id] = st
+        return first
+
+    def top_throttled(self, n: int = 10):
+        """(user_id, dropped) for users throttled within the idle TTL, worst first."""
+        self._evict(time.monotonic())
+        return sorted(((uid, st[0]) for uid, st in self._throttled.items()), key=lambda t: t[1], reverse=True)[:n]
+
+    def throttled_users(self) -> int:
+        return len(self._throttled)
+
+    def clear_throttled(self):
+        self._throttled.clear()
+
+    def _evict(self, now: float):
+        for entries, seen in ((self._windows, 3), (self._last_click, 2), (self._throttled, 1)):
+            while entries:
+                st = next(iter(entries.values()))
+                if now - st[seen] < self.idle_ttl:
+                    break
+                entries.popitem(last=False)
+
+    def active_users(self) -> int:
+        return len({user_id for user_id, _ in self._windows})
+
+
+FLOOD_GUARD = FloodGuard()
+
+
+def _flood_bucket(data: str) -> str:
+    for prefix in FLOOD_LIMITS:
+        if prefix and data.startswith(prefix):
+            return prefix
+    return ""
+
+
+async def _answer_dropped(query, text=None):
+    # unanswered callbacks leave the button spinning on the user's client
+    try:
+        await query.answer(text)
+    except TelegramError as e:
+        log.warning(f"answering dropped callback failed: {e}")
+
+
+async def flood_guard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Runs before all other handlers (group -1) and stops updates from users who are spamming."""
+    user = update.effective_user
+    if not user or user.id == ADMIN_ID:
+        return
+    now = time.monotonic()
+    if update.callback_query:
+        query = update.callback_query
+        data = query.data or ""
+        message_id = query.message.message_id if query.message else None
+        if FLOOD_GUARD.is_duplicate(user.id, message_id, data, now):
+            # the first click already gets answered; just clear this one's spinner
+            await _answer_dropped(query)
+            raise ApplicationHandlerStop
+        bucket = _flood_bucket(data)
+        limit, window = FLOOD_LIMITS[bucket]
+    elif update.message and update.message.text and not update.message.text.startswith("/"):
+        bucket = "text"
+        limit, window = TEXT_FLOOD_LIMIT
+    else:
+        return
+    if not FLOOD_GUARD.allow((user.id, bucket), limit, window, now):
+        first = FLOOD_GUARD.record_throttle(user.id, now, window)
+        if update.callback_query:
+            await _answer_dropped(update.callback_query, "⏳ Slow down a little…")
+        elif first:
+            # tell them once per episode, so the notice can't turn into a flood of its own
+            try:
+                await update.message.reply_text("⏳ You're sending messages too fast. Wait a few seconds, then send that again.")
+            except TelegramError as e:
+                log.warning(f"throttle notice failed: {e}")
+        raise ApplicationHandlerStop
+
+
 # ===== HANDLE SELECTION =====
 async def handle_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -316,9 +631,8 @@ async def handle_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not order:
             await safe_edit(query, "🛒 Your cart is empty!", InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="back")]]))
         else:
-            cart_lines = [f"• {i['qty']} {i['item']} - ${i['price']}" for i in order]
             total = sum(i['price'] for i in order)
-            await safe_edit(query, f"🛒 *Your Cart:*\n\n" + "\n".join(cart_lines) + f"\n\n💰 *Total:* ${total}", build_cart_menu(), None, "Markdown")
+            await safe_edit(query, CART_TEMPLATE.render(items=format_item_lines(order), total=total), build_cart_menu(), None, "Markdown")
 
     elif data == "clear_cart":
         context.user_data["order"] = []
@@ -346,8 +660,8 @@ async def handle_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data["last_order_time"] = now
         order_id = generate_order_id()
         total = sum(i['price'] for i in order)
-        items = "\n".join([f"• {i['qty']} {i['item']} - ${i['price']}" for i in order])
-        context.user_data["pending_order"] = {"id": order_id, "items": items, "total": total}
+        items = format_item_lines(order)
+        context.user_data["pending_order"] = {"id": order_id, "items": items, "total": total, "lines": [dict(i) for i in order]}
         context.user_data["order"] = []
         context.user_data["collecting_address"] = "first_name"
         await query.message.reply_text("📦 Please enter your *first name*:", parse_mode="Markdown")
@@ -432,17 +746,7 @@ async def send_orders_list(send_func, title: str, orders: list):
 
     # newest first
     sorted_orders = sorted(orders, key=lambda o: o.get("ts", 0), reverse=True)
-    lines = []
-    for o in sorted_orders:
-        addr = o.get("address", {})
-        lines.append(
-            "────────────\n"
-            f"#{o['id']}  |  🕒 {fmt_ts(o['ts'])}\n"
-            f"🔁 Return #: {addr.get('return_number','—')}\n"
-            f"👤 {o.get('name','')}  |  🆔 {o.get('user_id','')}\n"
-            f"{o['items']}\n"
-            f"💰 Total: ${o['total']}"
-        )
+    lines = [render_order_block(o) for o in sorted_orders]
     full = f"{title}\n\n" + "\n\n".join(lines)
     for part in chunk_text(full):
         await send_func(part, parse_mode="Markdown")
@@ -471,6 +775,298 @@ async def send_stats(send_func):
     await send_func(text, parse_mode="Markdown")
 
 
+# ===== ANALYTICS =====
+# Every (product, variant) pair gets a fixed integer code so order lines can live in flat arrays.
+VARIANT_KEYS = [(item, qty) for item, prices in PRODUCT_PRICES.items() for qty in prices]
+VARIANT_CODES = {key: n for n, key in enumerate(VARIANT_KEYS)}
+# "• 25x Turn" prefix -> (item, qty); used to read old orders that only stored the items text
+_ITEM_LINE_PREFIXES = {f"• {qty} {item}": (item, qty) for item, qty in VARIANT_KEYS}
+_PACK_RE = re.compile(r"(\d+)(?:/(\d+))?\s*(x|oz|LB)", re.IGNORECASE)
+
+
+def pack_size(qty: str):
+    """Units in one pack of a variant: "25x" -> (25, "pcs"), "1/4LB" -> (4, "oz")."""
+    m = _PACK_RE.match(qty)
+    if not m:
+        return 1, "packs"
+    n = int(m[1]) / int(m[2] or 1)
+    unit = m[3].lower()
+    if unit == "x":
+        return n, "pcs"
+    return (n * 16 if unit == "lb" else n), "oz"
+
+
+VARIANT_UNITS = [pack_size(qty)[0] for _, qty in VARIANT_KEYS]
+PRODUCT_UNIT_LABELS = {item: pack_size(qty)[1] for item, qty in VARIANT_KEYS}
+
+
+def order_lines(order: dict):
+    """Structured cart lines of an order, parsing the items text for older records."""
+    if order.get("lines"):
+        return order["lines"]
+    lines = []
+    for raw in (order.get("items") or "").splitlines():
+        head, sep, price = raw.rpartition(" - $")
+        if not sep or head not in _ITEM_LINE_PREFIXES or not price.isdigit():
+            continue
+        item, qty = _ITEM_LINE_PREFIXES[head]
+        lines.append({"item": item, "qty": qty, "price": int(price)})
+    return lines
+
+
+class OrderColumns:
+    """Columnar view of an order list, kept sorted by timestamp.
+
+    Orders are parallel arrays (ts / total / user_id) and their cart lines are
+    (ts / variant code / price / units) arrays, so a date range is a bisect on
+    each and aggregation only walks the flat numbers inside that range.
+    """
+
+    def __init__(self, orders=()):
+        self.count = 0
+        self.ts = array("d")
+        self.total = array("d")
+        self.user_id = array("q")
+        self.line_ts = array("d")
+        self.line_variant = array("l")
+        self.line_price = array("d")
+        self.line_units = array("d")
+        for o in sorted(orders, key=lambda o: o.get("ts", 0)):
+            self.add(o)
+
+    def add(self, order: dict):
+        """Insert one order at its timestamp position (an append for the usual newest order)."""
+        ts = order.get("ts", 0)
+        i = bisect_right(self.ts, ts)
+        self.ts.insert(i, ts)
+        self.total.insert(i, order.get("total") or 0)
+        self.user_id.insert(i, order.get("user_id") or 0)
+        for line in order_lines(order):
+            code = VARIANT_CODES.get((line["item"], line["qty"]))
+            if code is None:
+                continue
+            j = bisect_right(self.line_ts, ts)
+            self.line_ts.insert(j, ts)
+            self.line_variant.insert(j, code)
+            self.line_price.insert(j, line["price"])
+            self.line_units.insert(j, VARIANT_UNITS[code])
+        self.count += 1
+
+    def order_range(self, start_ts: float, end_ts: float):
+        """Index slice of orders with start_ts <= ts < end_ts."""
+        return bisect_left(self.ts, start_ts), bisect_left(self.ts, end_ts)
+
+    def line_range(self, start_ts: float, end_ts: float):
+        """Index slice of cart lines whose order has start_ts <= ts < end_ts."""
+        return bisect_left(self.line_ts, start_ts), bisect_left(self.line_ts, end_ts)
+
+
+COMPLETED_COLUMNS = OrderColumns()
+
+
+def completed_columns() -> OrderColumns:
+    """Column view of COMPLETED_ORDERS. ship_order adds to it; rebuilt only if the list changed some other way."""
+    global COMPLETED_COLUMNS
+    if COMPLETED_COLUMNS.count != len(COMPLETED_ORDERS):
+        COMPLETED_COLUMNS = OrderColumns(COMPLETED_ORDERS)
+    return COMPLETED_COLUMNS
+
+
+@lru_cache(maxsize=None)
+def _est_date_for_hour(hour: int) -> date:
+    # EST offsets are whole hours, so every timestamp in a UTC hour maps to the same local date
+    ts = hour * 3600
+    dt = datetime.fromtimestamp(ts, TZ_EST) if TZ_EST else datetime.fromtimestamp(ts)
+    return dt.date()
+
+
+def est_date_start_ts(d: date) -> float:
+    """Timestamp of midnight (EST if available) at the start of the given date."""
+    return datetime(d.year, d.month, d.day, tzinfo=TZ_EST).timestamp()
+
+
+def compute_analytics(cols: OrderColumns, start: date, end: date) -> dict:
+    """Aggregate revenue, units and trends for orders placed between start and end (inclusive)."""
+    start_ts, end_ts = est_date_start_ts(start), est_date_start_ts(end + timedelta(days=1))
+    lo, hi = cols.order_range(start_ts, end_ts)
+    llo, lhi = cols.line_range(start_ts, end_ts)
+
+    variant_revenue = Counter()
+    variant_packs = Counter()
+    line_variant, line_price = cols.line_variant, cols.line_price
+    for n in range(llo, lhi):
+        code = line_variant[n]
+        variant_revenue[code] += line_price[n]
+        variant_packs[code] += 1
+
+    products = {}
+    for code in sorted(variant_revenue, key=variant_revenue.get, reverse=True):
+        item, qty = VARIANT_KEYS[code]
+        product = products.setdefault(item, {"revenue": 0, "units": 0, "variants": []})
+        units = variant_packs[code] * VARIANT_UNITS[code]
+        product["revenue"] += variant_revenue[code]
+        product["units"] += units
+        product["variants"].append((qty, variant_packs[code], units, variant_revenue[code]))
+
+    daily = Counter()
+    weekly = Counter()
+    ts, total = cols.ts, cols.total
+    for n in range(lo, hi):
+        d = _est_date_for_hour(int(ts[n] // 3600))
+        daily[d] += total[n]
+        weekly[d - timedelta(days=d.weekday())] += total[n]
+
+    orders_per_user = Counter(cols.user_id[lo:hi])
+    revenue = sum(total[lo:hi])
+    order_count = hi - lo
+    customers = len(orders_per_user)
+    repeat = sum(1 for c in orders_per_user.values() if c > 1)
+
+    return {
+        "start": start,
+        "end": end,
+        "orders": order_count,
+        "revenue": revenue,
+        "aov": revenue / order_count if order_count else 0,
+        "customers": customers,
+        "repeat_rate": repeat / customers if customers else 0,
+        "products": sorted(products.items(), key=lambda kv: kv[1]["revenue"], reverse=True),
+        "daily": sorted(daily.items()),
+        "weekly": sorted(weekly.items()),
+    }
+
+
+async def send_analytics(send_func, start: date, end: date):
+    stats = compute_analytics(completed_columns(), start, end)
+    lines = [
+        "📈 *Sales Analytics*",
+        f"🗓️ {start:%b %d, %Y} – {end:%b %d, %Y}",
+        "────────────────────",
+        f"🧾 Orders: {stats['orders']}",
+        f"💰 Revenue: ${stats['revenue']:,.0f}",
+        f"🧮 Avg Order Value: ${stats['aov']:,.2f}",
+        f"👥 Customers: {stats['customers']}  |  🔁 Repeat: {stats['repeat_rate']:.0%}",
+        "",
+        "🛍️ *By Product*",
+    ]
+    if stats["products"]:
+        for item, p in stats["products"]:
+            unit = PRODUCT_UNIT_LABELS.get(item, "packs")
+            lines.append(f"• {item} — {p['units']:,.0f} {unit}, ${p['revenue']:,.0f}")
+            for qty, packs, units, rev in p["variants"]:
+                lines.append(f"    ◦ {qty}: {packs} packs ({units:,.0f} {unit}), ${rev:,.0f}")
+    else:
+        lines.append("No sales in this range.")
+
+    if stats["weekly"]:
+        lines += ["", "📅 *Weekly*"]
+        lines += [f"• wk of {wk:%b %d} — ${rev:,.0f}" for wk, rev in stats["weekly"]]
+    if stats["daily"]:
+        lines += ["", "📆 *Daily* (last 14 days with sales)"]
+        lines += [f"• {d:%b %d} — ${rev:,.0f}" for d, rev in stats["daily"][-14:]]
+
+    for part in chunk_text("\n".join(lines)):
+        await send_func(part, parse_mode="Markdown")
+
+
+# ===== EXPORT =====
+EXPORT_FIELDS = [
+    "id", "status", "user_id", "name", "ts", "total", "items",
+    "return_number", "first_name", "last_name", "full", "town", "state", "zip",
+    "tracking", "completed_ts",
+]
+
+
+def _iso_ts(ts):
+    if not ts:
+        return ""
+    return datetime.fromtimestamp(ts, TZ_EST).isoformat(timespec="seconds")
+
+
+_CSV_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _export_items(o: dict) -> str:
+    # legacy records keep their items text as-is, so lines for products no longer on the menu survive
+    if o.get("lines"):
+        return "; ".join(f"{l['qty']} {l['item']} - ${l['price']}" for l in o["lines"])
+    return "; ".join(raw.removeprefix("• ") for raw in (o.get("items") or "").splitlines())
+
+
+def _csv_safe(value):
+    """Stop spreadsheets from treating user-supplied text as a formula."""
+    if isinstance(value, str) and value.startswith(_CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+class StreamedInputFile(InputFile):
+    """InputFile that hands the open file to the HTTP client to stream instead of reading it into memory."""
+
+    def __init__(self, fileobj, filename: str):
+        super().__init__(b"", filename=filename)
+        self.input_file_content = fileobj
+        # mimetypes sees "orders_*.csv.gz" as text/csv; the bytes are gzip
+        self.mimetype = "application/gzip"
+
+
+def export_sources(status: str = "all"):
+    """Snapshot of the order lists to export, safe to read from a worker thread."""
+    sources = []
+    if status in ("all", "pending"):
+        sources.append(("pending", list(ORDERS_LOG)))
+    if status in ("all", "completed"):
+        sources.append(("completed", list(COMPLETED_ORDERS)))
+    return sources
+
+
+def iter_export_rows(sources, start_ts: float = None, end_ts: float = None):
+    """Yield one flat dict per order, never building the full result in memory."""
+    for label, orders in sources:
+        for o in orders:
+            ts = o.get("ts", 0)
+            if (start_ts is not None and ts < start_ts) or (end_ts is not None and ts >= end_ts):
+                continue
+            addr = o.get("address", {})
+            yield {
+                "id": o.get("id"),
+                "status": label,
+                "user_id": o.get("user_id"),
+                "name": o.get("name", ""),
+                "ts": _iso_ts(ts),
+                "total": o.get("total", 0),
+                "items": _export_items(o),
+                "return_number": addr.get("return_number", ""),
+                "first_name": addr.get("first_name", ""),
+                "last_name": addr.get("last_name", ""),
+                "full": addr.get("full", ""),
+                "town": addr.get("town", ""),
+                "state": addr.get("state", ""),
+                "zip": addr.get("zip", ""),
+                "tracking": o.get("tracking", ""),
+                "completed_ts": _iso_ts(o.get("completed_ts")),
+            }
+
+
+def write_export(fileobj, rows, fmt: str = "csv") -> int:
+    """Stream rows into fileobj as gzip-compressed CSV or JSONL. Returns the row count."""
+    count = 0
+    with gzip.GzipFile(fileobj=fileobj, mode="wb") as gz, \
+            io.TextIOWrapper(gz, encoding="utf-8", newline="") as out:
+        if fmt == "csv":
+            writer = csv.DictWriter(out, fieldnames=EXPORT_FIELDS)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow({k: _csv_safe(v) for k, v in row.items()})
+                count += 1
+        else:
+            for row in rows:
+                out.write(json.dumps(row, ensure_ascii=False))
+                out.write("\n")
+                count += 1
+    return count
+
+
 def get_last_order_for_user(user_id: int):
     """Return the user's latest order (from current or completed)."""
     latest = None
@@ -561,16 +1157,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         total = order.get("total")
         items = order.get("items")
 
-        summary = (
-            f"✅ *Order #{order_id} Complete!*\n\n"
-            f"{items}\n\n"
-            f"💰 *Total:* ${total}\n"
-            f"🔁 *Return #:* {addr['return_number']}\n\n"
-            f"📍 *Shipping Address:*\n"
-            f"{addr['first_name']} {addr['last_name']}\n"
-            f"{addr['full']}\n"
-            f"{addr['town']}, {addr['state']} {addr['zip']}"
-        )
+        summary = ORDER_SUMMARY_TEMPLATE.render(order_id=order_id, items=items, total=total, **addr)
 
         # Use same fallback mechanism so your ibb.co URLs still show via preview if needed
         await _send_photo_or_link(update.message, CONFIRMATION_IMAGE_URL, summary, "Markdown")
@@ -587,6 +1174,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "user_id": user.id,
             "name": user.first_name,
             "items": items,
+            "lines": order.get("lines", []),
             "total": total,
             "address": addr.copy(),
             "ts": time.time(),
@@ -595,18 +1183,15 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         LAST_ORDER_BY_USER[user.id] = order_record
         PENDING_PAYMENTS[user.id] = order_id
 
-        admin_msg = (
-            f"📦 *New Order #{order_id}*\n"
-            f"🔁 Return #: {addr['return_number']}\n"
-            f"👤 Buyer: {user.first_name} ({user.username or 'no username'})\n"
-            f"🆔 ID: {user.id}\n\n"
-            f"{items}\n💰 *Total:* ${total}\n\n"
-            f"📍 *Shipping Address:*\n"
-            f"{addr['first_name']} {addr['last_name']}\n"
-            f"{addr['full']}\n"
-            f"{addr['town']}, {addr['state']} {addr['zip']}\n"
-            f"🕒 {fmt_ts(order_record['ts'])}\n"
-            f"⌛ Awaiting payment."
+        admin_msg = ADMIN_ORDER_ALERT_TEMPLATE.render(
+            order_id=order_id,
+            buyer=user.first_name,
+            username=user.username or "no username",
+            user_id=user.id,
+            items=items,
+            total=total,
+            ts=fmt_ts(order_record["ts"]),
+            **addr,
         )
         await context.bot.send_message(chat_id=ADMIN_ID, text=admin_msg, parse_mode="Markdown")
         await update.message.reply_text("✅ Once your payment is received, you'll get a confirmation message.")
@@ -634,6 +1219,59 @@ async def accept_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(f"✅ Payment confirmed for user {user_id}.")
 
 
+async def analytics(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/analytics [start YYYY-MM-DD] [end YYYY-MM-DD] — defaults to the last 30 days."""
+    if update.message.from_user.id != ADMIN_ID:
+        return
+    try:
+        dates = [datetime.strptime(a, "%Y-%m-%d").date() for a in context.args[:2]]
+    except ValueError:
+        await update.message.reply_text("Usage: /analytics [start YYYY-MM-DD] [end YYYY-MM-DD]")
+        return
+    end = dates[1] if len(dates) > 1 else est_today_date()
+    start = dates[0] if dates else end - timedelta(days=29)
+    if start > end:
+        start, end = end, start
+    await send_analytics(update.message.reply_text, start, end)
+
+
+async def export_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/export [csv|jsonl] [all|pending|completed] [start YYYY-MM-DD] [end YYYY-MM-DD]"""
+    if update.message.from_user.id != ADMIN_ID:
+        return
+    fmt, status, dates = "csv", "all", []
+    try:
+        for arg in context.args:
+            if arg.lower() in ("csv", "jsonl"):
+                fmt = arg.lower()
+            elif arg.lower() in ("all", "pending", "completed"):
+                status = arg.lower()
+            else:
+                dates.append(datetime.strptime(arg, "%Y-%m-%d").date())
+    except ValueError:
+        await update.message.reply_text("Usage: /export [csv|jsonl] [all|pending|completed] [start YYYY-MM-DD] [end YYYY-MM-DD]")
+        return
+    start_ts = est_date_start_ts(dates[0]) if dates else None
+    end_ts = est_date_start_ts(dates[1] + timedelta(days=1)) if len(dates) > 1 else None
+
+    started = time.perf_counter()
+    rows = iter_export_rows(export_sources(status), start_ts, end_ts)
+    with tempfile.TemporaryFile() as tmp:
+        # compress in a worker thread so a large history doesn't stall other users' updates
+        count = await asyncio.to_thread(write_export, tmp, rows, fmt)
+        elapsed = time.perf_counter() - started
+        size = tmp.tell()
+        tmp.seek(0)
+        filename = f"orders_{status}_{est_today_date():%Y%m%d}.{fmt}.gz"
+        await update.message.reply_document(
+            document=StreamedInputFile(tmp, filename),
+            caption=(
+                f"📤 Exported {count} {status} orders ({size / 1024:,.1f} KB gz) "
+                f"in {elapsed * 1000:,.0f} ms — {count / elapsed if elapsed else 0:,.0f} rows/s"
+            ),
+        )
+
+
 def find_latest_pending_order_for_user(user_id: int):
     if not ORDERS_LOG:
         return None
@@ -665,30 +1303,202 @@ async def ship_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
     order_completed = dict(order)
     order_completed["tracking"] = tracking_number
     order_completed["completed_ts"] = order_completed_ts
+    completed_columns().add(order_completed)
     COMPLETED_ORDERS.append(order_completed)
     LAST_ORDER_BY_USER[user_id] = order_completed
 
     await context.bot.send_message(
         user_id,
-        f"🚚 *Order complete!* Your tracking number is `{tracking_number}`.\nThank you for your order!",
+        SHIPPING_NOTICE_TEMPLATE.render(tracking=code_span(tracking_number)),
         parse_mode="Markdown"
     )
 
     addr = order.get("address", {})
-    admin_notice = (
-        f"✅ *Order Shipped*\n"
-        f"#{order.get('id')} | 🕒 {fmt_ts(order_completed_ts)}\n"
-        f"👤 Buyer: {order.get('name','')} (ID: {order.get('user_id')})\n"
-        f"🔁 Return #: {addr.get('return_number','—')}\n"
-        f"{order.get('items','')}\n"
-        f"💰 Total: ${order.get('total',0)}\n"
-        f"🚚 Tracking: `{tracking_number}`"
+    admin_notice = ADMIN_SHIPPED_TEMPLATE.render(
+        order_id=order.get("id"),
+        ts=fmt_ts(order_completed_ts),
+        buyer=order.get("name", ""),
+        user_id=order.get("user_id"),
+        return_number=addr.get("return_number", "—"),
+        items=order.get("items", ""),
+        total=order.get("total", 0),
+        tracking=code_span(tracking_number),
     )
     await context.bot.send_message(chat_id=ADMIN_ID, text=admin_notice, parse_mode="Markdown")
 
     await update.message.reply_text(f"✅ Order #{order.get('id')} marked completed and shipping sent.")
 
 
+# ===== BROADCAST =====
+BROADCAST_RATE = 25          # messages/sec, kept under Telegram's ~30/s global limit
+BROADCAST_CONCURRENCY = 8    # in-flight sends per batch
+BROADCAST_BATCH = 100        # recipients between checkpoints / progress updates
+BROADCAST_RETRIES = 3
+
+
+class RateLimiter:
+    """Spaces calls evenly so that at most `rate` go out per second across all workers."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            # loop rather than sleep once: pause() may push _next further out while we sleep
+            while (now := time.monotonic()) < self._next:
+                await asyncio.sleep(self._next - now)
+            self._next = now + self.interval
+
+    def pause(self, seconds: float):
+        """Hold every caller back for `seconds`, e.g. while Telegram's flood wait runs."""
+        self._next = max(self._next, time.monotonic() + seconds)
+
+
+# one limiter for every broadcast, including several resumed at startup
+BROADCAST_LIMITER = RateLimiter(BROADCAST_RATE)
+
+
+def broadcast_progress_text(job: dict) -> str:
+    total = len(job["recipients"])
+    done = "✅ Broadcast finished" if job["status"] == "done" else "📣 Broadcasting…"
+    return (
+        f"{done}\n"
+        f"📬 {job['next_index']}/{total} processed\n"
+        f"✅ Sent: {job['sent']}  |  🚫 Blocked: {job['blocked']}  |  ❌ Failed: {job['failed']}"
+    )
+
+
+async def _broadcast_one(bot, job: dict, user_id: int, limiter: RateLimiter):
+    for _ in range(BROADCAST_RETRIES):
+        await limiter.wait()
+        try:
+            if job["photo"]:
+                await bot.send_photo(user_id, photo=job["photo"], caption=job["text"] or None)
+            else:
+                await bot.send_message(user_id, job["text"])
+            job["sent"] += 1
+            return
+        except RetryAfter as e:
+            log.warning(f"broadcast flood control, pausing all sends for {e.retry_after}s")
+            limiter.pause(float(e.retry_after))
+        except Forbidden:
+            # user blocked the bot or deleted their account — stop messaging them
+            job["blocked"] += 1
+            KNOWN_USERS.discard(user_id)
+            return
+        except NetworkError as e:
+            # includes TimedOut; transient, so spend another attempt on it
+            log.warning(f"broadcast to {user_id} hit a network error, retrying: {e}")
+        except TelegramError as e:
+            # BadRequest and the like won't succeed on retry
+            log.warning(f"broadcast to {user_id} failed: {e}")
+            break
+    job["failed"] += 1
+
+
+async def _broadcast_worker(bot, job: dict, queue: asyncio.Queue, limiter: RateLimiter):
+    while True:
+        try:
+            user_id = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        await _broadcast_one(bot, job, user_id, limiter)
+
+
+async def _update_broadcast_progress(bot, job: dict):
+    if not job.get("message_id"):
+        return
+    try:
+        await bot.edit_message_text(chat_id=job["chat_id"], message_id=job["message_id"], text=broadcast_progress_text(job))
+    except TelegramError as e:
+        log.warning(f"broadcast progress update failed: {e}")
+
+
+async def run_broadcast(bot, job: dict, pool=None, limiter: RateLimiter = None):
+    """Send job to its recipients from job['next_index'], checkpointing after every batch."""
+    limiter = limiter or BROADCAST_LIMITER
+    recipients = job["recipients"]
+    while job["next_index"] < len(recipients):
+        queue = asyncio.Queue()
+        for user_id in recipients[job["next_index"]:job["next_index"] + BROADCAST_BATCH]:
+            queue.put_nowait(user_id)
+        batch_size = queue.qsize()
+        await asyncio.gather(*(
+            _broadcast_worker(bot, job, queue, limiter)
+            for _ in range(min(BROADCAST_CONCURRENCY, batch_size))
+        ))
+        job["next_index"] += batch_size
+        if job["next_index"] >= len(recipients):
+            job["status"] = "done"
+        if pool:
+            await checkpoint_broadcast(pool, job)
+        await _update_broadcast_progress(bot, job)
+    job["status"] = "done"
+    return job
+
+
+async def resume_broadcasts(app, pool):
+    """Restart broadcasts that were still running when the bot last stopped."""
+    for job in await load_running_broadcasts(pool):
+        log.info(f"resuming broadcast #{job['id']} at {job['next_index']}/{len(job['recipients'])}")
+        app.create_task(run_broadcast(app.bot, job, pool))
+
+
+async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/broadcast <message> — reply to a photo to send that photo with the message as caption."""
+    if update.message.from_user.id != ADMIN_ID:
+        return
+    parts = update.message.text.split(" ", 1)
+    text = parts[1].strip() if len(parts) > 1 else ""
+    reply = update.message.reply_to_message
+    photo = reply.photo[-1].file_id if reply and reply.photo else None
+    if photo and not text:
+        text = reply.caption or ""
+    if not text and not photo:
+        await update.message.reply_text("Usage: /broadcast <message> (reply to a photo to include it)")
+        return
+
+    recipients = sorted(KNOWN_USERS - {ADMIN_ID})
+    if not recipients:
+        await update.message.reply_text("📭 No known users to broadcast to yet.")
+        return
+
+    job = {
+        "id": None, "text": text, "photo": photo, "recipients": recipients,
+        "next_index": 0, "sent": 0, "failed": 0, "blocked": 0, "status": "running",
+    }
+    progress = await update.message.reply_text(broadcast_progress_text(job))
+    job["chat_id"], job["message_id"] = progress.chat_id, progress.message_id
+
+    pool = context.bot_data.get("db_pool")
+    if pool:
+        job["id"] = await create_broadcast(pool, text, photo, recipients, job["chat_id"], job["message_id"])
+    context.application.create_task(run_broadcast(context.bot, job, pool))
+
+
+async def throttled(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/throttled [reset] — summary of users dropped by the anti-flood guard."""
+    if update.message.from_user.id != ADMIN_ID:
+        return
+    if context.args and context.args[0].lower() == "reset":
+        FLOOD_GUARD.clear_throttled()
+        await update.message.reply_text("✅ Throttle counters cleared.")
+        return
+    lines = [
+        "🛡️ *Anti-Flood Summary*",
+        "────────────────────",
+        f"👥 Active users tracked: {FLOOD_GUARD.active_users()}",
+        f"🚫 Users throttled (last {FLOOD_IDLE_TTL // 60} min): {FLOOD_GUARD.throttled_users()}",
+    ]
+    top = FLOOD_GUARD.top_throttled(10)
+    if top:
+        lines.append("")
+        lines += [f"• 🆔 {user_id} — {count} dropped" for user_id, count in top]
+    await update.message.reply_text("\n".join(lines), parse_mode="Markdown")
+
+
 # ===== /requesthelp COMMAND =====
 async def request_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Users can DM /requesthelp <optional message>. Admin is DM'd; 24h cooldown enforced."""
@@ -710,12 +1520,12 @@ async def request_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
     order_id = f"#{latest_order['id']}" if latest_order else "N/A"
     return_num = latest_order.get("address", {}).get("return_number", "—") if latest_order else "—"
 
-    admin_alert = (
-        "🚨 *Help Request*\n"
-        f"👤 From: @{user.username or 'no_username'} ({user.id})\n"
-        f"🧾 Order ID: {order_id}\n"
-        f"🔁 Return #: {return_num}\n"
-        f"💬 Message: {user_msg}"
+    admin_alert = HELP_ALERT_TEMPLATE.render(
+        username=user.username or "no_username",
+        user_id=user.id,
+        order_id=order_id,
+        return_number=return_num,
+        message=user_msg,
     )
     await context.bot.send_message(chat_id=ADMIN_ID, text=admin_alert, parse_mode="Markdown")
 
@@ -729,11 +1539,17 @@ if __name__ == "__main__":
 
         # === Build and run the bot ===
         app = ApplicationBuilder().token(BOT_TOKEN).build()
+        app.bot_data["db_pool"] = pool
 
+        app.add_handler(TypeHandler(Update, flood_guard), group=-1)
         app.add_handler(CommandHandler("start", start))
         app.add_handler(CommandHandler("admin", admin))
         app.add_handler(CommandHandler("accept", accept_payment))
         app.add_handler(CommandHandler("ship", ship_order))
+        app.add_handler(CommandHandler("analytics", analytics))
+        app.add_handler(CommandHandler("export", export_orders))
+        app.add_handler(CommandHandler("broadcast", broadcast))
+        app.add_handler(CommandHandler("throttled", throttled))
         app.add_handler(CommandHandler("requesthelp", request_help))
         app.add_handler(CommandHandler("faq", faq))
         app.add_handler(CommandHandler("mustread", mustread))
@@ -745,6 +1561,7 @@ if __name__ == "__main__":
         await app.initialize()
         await app.start()
         await app.updater.start_polling()
+        await resume_broadcasts(app, pool)
         await asyncio.Event().wait()  # keep it alive forever
 
     asyncio.get_event_loop().run_until_complete(main())